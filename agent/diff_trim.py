@@ -0,0 +1,134 @@
+import logging
+import posixpath
+import re
+from functools import lru_cache
+
+import tiktoken
+
+logger = logging.getLogger(__name__)
+
+_FILE_HEADER = re.compile(r"^diff --git ", re.MULTILINE)
+
+# Source files are reviewed ahead of docs, lockfiles and generated assets when the diff
+# does not fit the token budget.
+_EXTENSION_WEIGHTS = {
+    ".py": 3.0,
+    ".go": 3.0,
+    ".ts": 3.0,
+    ".tsx": 3.0,
+    ".js": 2.5,
+    ".jsx": 2.5,
+    ".java": 2.5,
+    ".kt": 2.5,
+    ".rs": 2.5,
+    ".c": 2.5,
+    ".cc": 2.5,
+    ".cpp": 2.5,
+    ".h": 2.0,
+    ".rb": 2.0,
+    ".sql": 2.0,
+    ".yaml": 1.0,
+    ".yml": 1.0,
+    ".toml": 1.0,
+    ".json": 0.5,
+    ".md": 0.5,
+    ".lock": 0.1,
+}
+
+# Rough characters per token for code, used when no tiktoken encoding can be loaded.
+_CHARS_PER_TOKEN = 4
+
+
+@lru_cache(maxsize=4)
+def _encoding(model: str) -> tiktoken.Encoding | None:
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            # Non-OpenAI models (e.g. Gemini) have no tiktoken mapping; cl100k_base is a
+            # close enough estimate for budgeting.
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        # tiktoken fetches its BPE files on first use, which fails without network access.
+        logger.warning(
+            "Could not load a tiktoken encoding for %s, estimating tokens from characters",
+            model,
+            exc_info=True,
+        )
+        return None
+
+
+def _count_tokens(encoding: tiktoken.Encoding | None, text: str) -> int:
+    if encoding is None:
+        return -(-len(text) // _CHARS_PER_TOKEN)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def _head(encoding: tiktoken.Encoding | None, text: str, max_tokens: int) -> str:
+    if encoding is None:
+        return text[: max_tokens * _CHARS_PER_TOKEN]
+    return encoding.decode(encoding.encode(text, disallowed_special=())[:max_tokens])
+
+
+def _split_files(pr_diff: str) -> list[str]:
+    starts = [match.start() for match in _FILE_HEADER.finditer(pr_diff)]
+    if not starts:
+        return [pr_diff]
+    if starts[0] != 0:
+        starts.insert(0, 0)
+    return [pr_diff[start:end] for start, end in zip(starts, [*starts[1:], len(pr_diff)])]
+
+
+def _file_path(section: str) -> str:
+    header = section.split("\n", 1)[0]
+    _, _, path = header.rpartition(" b/")
+    return path
+
+
+def _score(section: str) -> float:
+    _, extension = posixpath.splitext(_file_path(section))
+    lines = section.count("\n") or 1
+    additions = sum(
+        1 for line in section.splitlines() if line.startswith("+") and not line.startswith("+++")
+    )
+    return _EXTENSION_WEIGHTS.get(extension.lower(), 1.5) + additions / lines
+
+
+def trim_diff(pr_diff: str, model: str, max_tokens: int) -> str:
+    # Byte-level BPE emits at most one token per UTF-8 byte, so short diffs cannot exceed
+    # the budget.
+    if len(pr_diff.encode()) <= max_tokens:
+        return pr_diff
+
+    encoding = _encoding(model)
+    sections = _split_files(pr_diff)
+    costs = [_count_tokens(encoding, section) for section in sections]
+    if sum(costs) <= max_tokens:
+        return pr_diff
+
+    ranked = sorted(range(len(sections)), key=lambda i: _score(sections[i]), reverse=True)
+    kept: dict[int, str] = {}
+    budget = max_tokens
+    for index in ranked:
+        if costs[index] <= budget:
+            kept[index] = sections[index]
+            budget -= costs[index]
+
+    # Spend what is left of the budget on the head of the best file that did not fit.
+    partial = next((index for index in ranked if index not in kept), None)
+    if partial is not None and budget > 0:
+        kept[partial] = _head(encoding, sections[partial], budget) + "\n"
+
+    omitted = [
+        _file_path(sections[i]) or "<unknown>"
+        for i in range(len(sections))
+        if i not in kept or i == partial
+    ]
+    logger.info(
+        "Trimmed PR diff to %s/%s files within %s tokens",
+        len(kept),
+        len(sections),
+        max_tokens,
+    )
+    trimmed = "".join(kept[i] for i in sorted(kept))
+    return f"{trimmed}\n[Omitted or truncated to fit the review token budget: {', '.join(omitted)}]\n"
@@ -1,10 +1,12 @@
+import asyncio
 import logging
+from functools import lru_cache
 
 from langgraph.graph import END, START, StateGraph
 
-from agent.nodes import committer_agent, patcher_agent, reviewer_agent
+from agent.nodes import committer_agent, lgtm_agent, patcher_agent, reviewer_agent
 from agent.state import GraphState
-from github_api.client import GitHubClient
+from github_api.client import GitHubClient, GitHubCommentQueue
 
 logger = logging.getLogger(__name__)
 
@@ -13,7 +15,7 @@ def _route_after_review(state: GraphState) -> str:
     review_result = state.get("review_result")
     if review_result and review_result.has_bugs:
         return "patcher"
-    return "committer"
+    return "lgtm"
 
 
 def build_graph():
@@ -21,6 +23,7 @@ def build_graph():
     workflow.add_node("reviewer", reviewer_agent)
     workflow.add_node("patcher", patcher_agent)
     workflow.add_node("committer", committer_agent)
+    workflow.add_node("lgtm", lgtm_agent)
 
     workflow.add_edge(START, "reviewer")
     workflow.add_conditional_edges(
@@ -28,24 +31,27 @@ def build_graph():
         _route_after_review,
         {
             "patcher": "patcher",
-            "committer": "committer",
+            "lgtm": "lgtm",
         },
     )
     workflow.add_edge("patcher", "committer")
     workflow.add_edge("committer", END)
+    workflow.add_edge("lgtm", END)
     return workflow.compile()
 
 
-GRAPH = build_graph()
+@lru_cache(maxsize=1)
+def get_graph():
+    return build_graph()
 
 
-async def run_pr_review(
+def _initial_state(
     repo_name: str,
     pr_number: int,
     pr_diff: str,
     github_client: GitHubClient | None = None,
+    comment_queue: GitHubCommentQueue | None = None,
 ) -> GraphState:
-    logger.info("Running review graph for %s#%s", repo_name, pr_number)
     initial_state: GraphState = {
         "repo_name": repo_name,
         "pr_number": pr_number,
@@ -56,7 +62,79 @@ async def run_pr_review(
     }
     if github_client is not None:
         initial_state["github_client"] = github_client
+    if comment_queue is not None:
+        initial_state["comment_queue"] = comment_queue
+    return initial_state
+
 
-    result = await GRAPH.ainvoke(initial_state)
+async def run_pr_review(
+    repo_name: str,
+    pr_number: int,
+    pr_diff: str,
+    github_client: GitHubClient | None = None,
+    comment_queue: GitHubCommentQueue | None = None,
+) -> GraphState:
+    logger.info("Running review graph for %s#%s", repo_name, pr_number)
+    initial_state = _initial_state(repo_name, pr_number, pr_diff, github_client, comment_queue)
+    result = await get_graph().ainvoke(initial_state)
     logger.info("Review graph completed for %s#%s", repo_name, pr_number)
     return result
+
+
+class PRReviewQueue:
+    def __init__(
+        self,
+        github_client: GitHubClient,
+        max_concurrent_prs: int = 4,
+        comment_queue: GitHubCommentQueue | None = None,
+    ) -> None:
+        self._github_client = github_client
+        self._comment_queue = comment_queue
+        self._queue: asyncio.Queue[tuple[str, int] | None] = asyncio.Queue()
+        self._worker: asyncio.Task | None = None
+        self._semaphore = asyncio.Semaphore(max_concurrent_prs)
+
+    def start(self) -> None:
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self, timeout: float | None = None) -> None:
+        if self._worker is None:
+            return
+        # The sentinel lets the worker start every review queued before it and wait for all
+        # of them; only reviews still running at the timeout are cancelled.
+        await self._queue.put(None)
+        try:
+            await asyncio.wait_for(self._worker, timeout)
+        except TimeoutError:
+            logger.warning("Timed out after %ss draining PR reviews, cancelled the rest", timeout)
+        self._worker = None
+
+    async def submit(self, repo_name: str, pr_number: int) -> None:
+        await self._queue.put((repo_name, pr_number))
+
+    async def _run(self) -> None:
+        # Per-PR failures are handled in _review, so the group only unwinds on cancellation,
+        # which it passes on to every review still running.
+        async with asyncio.TaskGroup() as tg:
+            while (item := await self._queue.get()) is not None:
+                repo_name, pr_number = item
+                tg.create_task(self._review(repo_name, pr_number))
+
+    async def _review(self, repo_name: str, pr_number: int) -> None:
+        try:
+            # Acquire inside the try so a review cancelled while waiting for a slot is logged too.
+            async with self._semaphore:
+                pr_diff = await self._github_client.get_pr_diff(repo_name, pr_number)
+                await run_pr_review(
+                    repo_name=repo_name,
+                    pr_number=pr_number,
+                    pr_diff=pr_diff,
+                    github_client=self._github_client,
+                    comment_queue=self._comment_queue,
+                )
+        except asyncio.CancelledError:
+            logger.warning("Review cancelled for %s#%s", repo_name, pr_number)
+            raise
+        except Exception:
+            logger.exception("Review failed for %s#%s", repo_name, pr_number)
@@ -1,156 +1,338 @@
+import asyncio
 import logging
+from functools import lru_cache
+from typing import Any, Literal
 
+import orjson
+from aiolimiter import AsyncLimiter
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_openai import ChatOpenAI
+from pydantic import ValidationError
 
-from agent.state import GraphState, ReviewResult
+from agent.diff_trim import trim_diff
+from agent.state import GraphState, ReviewIssue, ReviewResult
 from config import get_settings
 from github_api.client import GitHubClient
 
 logger = logging.getLogger(__name__)
 
+# Static instructions live in the system message and the per-PR content is kept at the
+# tail, so the prompt prefix is byte-identical across calls and eligible for the
+# providers' automatic prompt caching.
+_REVIEW_PROMPT = ChatPromptTemplate.from_messages(
+    [
+        (
+            "system",
+            (
+                "You are a strict senior SDE reviewer. Focus on concurrency bugs, null pointer risks, "
+                "race conditions, async misuse, and business logic vulnerabilities. "
+                "Only report actionable issues and return structured output."
+            ),
+        ),
+        (
+            "human",
+            "Please review the following PR diff:\n\n{pr_diff}",
+        ),
+    ]
+)
+
+_PATCH_PROMPT = ChatPromptTemplate.from_messages(
+    [
+        (
+            "system",
+            (
+                "You are a principal engineer. Based on review issues, generate concrete patch guidance "
+                "or code snippets to fix the bugs. Keep output concise and markdown-friendly. "
+                "Return a patch proposal with code snippets."
+            ),
+        ),
+        (
+            "human",
+            (
+                "PR diff:\n{pr_diff}\n\n"
+                "Review result:\n{review_result}"
+            ),
+        ),
+    ]
+)
+
+_COMMENT_PROMPT = ChatPromptTemplate.from_messages(
+    [
+        (
+            "system",
+            (
+                "You are a friendly code review assistant. Generate a GitHub PR comment in markdown, "
+                "including a short summary, issue list, and suggested fix snippets. "
+                "Produce the final PR review comment from the review result and patch proposal."
+            ),
+        ),
+        (
+            "human",
+            (
+                "Review result JSON:\n{review_result}\n\n"
+                "Patch proposal:\n{patch_code}"
+            ),
+        ),
+    ]
+)
+
+
+ModelTier = Literal["fast", "full"]
+
 
-def _build_chat_model():
+def _model_name(tier: ModelTier = "full") -> str:
+    settings = get_settings()
+    if tier == "fast" and settings.llm_fast_model:
+        return settings.llm_fast_model
+    return settings.llm_model
+
+
+@lru_cache(maxsize=4)
+def _build_chat_model(model: str):
     settings = get_settings()
     provider = settings.llm_provider.strip().lower()
 
     if provider == "openai":
         return ChatOpenAI(
-            model=settings.llm_model,
+            model=model,
             api_key=settings.llm_api_key,
             temperature=0,
         )
 
     return ChatGoogleGenerativeAI(
-        model=settings.llm_model,
+        model=model,
         google_api_key=settings.llm_api_key,
         temperature=0,
     )
 
 
+@lru_cache(maxsize=4)
+def _llm_rate_limiter(provider: str) -> AsyncLimiter:
+    return AsyncLimiter(get_settings().llm_max_requests_per_minute, time_period=60)
+
+
+def _llm_limiter() -> AsyncLimiter:
+    return _llm_rate_limiter(get_settings().llm_provider.strip().lower())
+
+
+@lru_cache(maxsize=2)
+def _build_review_model(model: str):
+    # A JSON schema (rather than the pydantic class) makes the structured output stream
+    # partial dicts, so the patcher can be started before the review has finished.
+    return _build_chat_model(model).with_structured_output(ReviewResult.model_json_schema())
+
+
+def _review_tier(pr_diff: str) -> ModelTier:
+    if len(pr_diff) < get_settings().llm_fast_diff_max_chars:
+        return "fast"
+    return "full"
+
+
+def _dump_review(review_result: ReviewResult) -> str:
+    return orjson.dumps(review_result.model_dump(mode="json")).decode()
+
+
+def _speculation_snapshot(partial_review: dict[str, Any]) -> list[ReviewIssue] | None:
+    # Issues stream before the summary, so once the summary key appears the issue list is final.
+    if partial_review.get("has_bugs") is not True or "summary" not in partial_review:
+        return None
+    try:
+        issues = [ReviewIssue.model_validate(issue) for issue in partial_review.get("issues") or []]
+    except ValidationError:
+        return None
+    return issues or None
+
+
+async def _generate_patch(pr_diff: str, review_result_json: str) -> str:
+    llm = _build_chat_model(_model_name())
+    chain = _PATCH_PROMPT | llm
+    await _llm_limiter().acquire()
+    patch_resp = await chain.ainvoke(
+        {
+            "pr_diff": pr_diff,
+            "review_result": review_result_json,
+        }
+    )
+    return patch_resp.content if isinstance(patch_resp.content, str) else str(patch_resp.content)
+
+
+def _consume_outcome(task: asyncio.Task[str]) -> None:
+    # Discarded speculative patches are never awaited; reading the outcome here keeps asyncio
+    # from logging "exception was never retrieved" for them.
+    if not task.cancelled():
+        task.exception()
+
+
 async def reviewer_agent(state: GraphState) -> GraphState:
     logger.info("Reviewer agent started for %s#%s", state["repo_name"], state["pr_number"])
-    llm = _build_chat_model().with_structured_output(ReviewResult)
-
-    prompt = ChatPromptTemplate.from_messages(
-        [
-            (
-                "system",
-                (
-                    "You are a strict senior SDE reviewer. Focus on concurrency bugs, null pointer risks, "
-                    "race conditions, async misuse, and business logic vulnerabilities. "
-                    "Only report actionable issues and return structured output."
-                ),
-            ),
-            (
-                "human",
-                "Please review the following PR diff:\n\n{pr_diff}",
-            ),
-        ]
+    settings = get_settings()
+    # Tokenizing a large diff is CPU-bound, so keep it off the event loop.
+    pr_diff = await asyncio.to_thread(
+        trim_diff, state["pr_diff"], settings.llm_model, settings.llm_max_diff_tokens
     )
+    model = _model_name(_review_tier(pr_diff))
+    logger.info(
+        "Reviewer agent using model %s for %s#%s", model, state["repo_name"], state["pr_number"]
+    )
+    llm = _build_review_model(model)
+
+    chain = _REVIEW_PROMPT | llm
+    partial_review: dict[str, Any] = {}
+    speculative_patch: asyncio.Task[str] | None = None
+    speculative_issues: list[ReviewIssue] | None = None
+    try:
+        await _llm_limiter().acquire()
+        async for chunk in chain.astream({"pr_diff": pr_diff}):
+            if not isinstance(chunk, dict):
+                continue
+            partial_review = chunk
+            if speculative_patch is not None:
+                continue
+            speculative_issues = _speculation_snapshot(partial_review)
+            if speculative_issues is not None:
+                logger.info(
+                    "Starting speculative patch for %s#%s", state["repo_name"], state["pr_number"]
+                )
+                snapshot_json = orjson.dumps(
+                    {
+                        "has_bugs": True,
+                        "issues": [issue.model_dump(mode="json") for issue in speculative_issues],
+                    }
+                ).decode()
+                speculative_patch = asyncio.create_task(_generate_patch(pr_diff, snapshot_json))
+                speculative_patch.add_done_callback(_consume_outcome)
+        review_result = ReviewResult.model_validate(partial_review)
+    except BaseException:
+        if speculative_patch is not None:
+            speculative_patch.cancel()
+        raise
 
-    chain = prompt | llm
-    review_result = await chain.ainvoke({"pr_diff": state["pr_diff"]})
     logger.info(
         "Reviewer agent finished for %s#%s, has_bugs=%s",
         state["repo_name"],
         state["pr_number"],
         review_result.has_bugs,
     )
-    return {"review_result": review_result}
+    if speculative_patch is not None and not review_result.has_bugs:
+        logger.info(
+            "Cancelling speculative patch for %s#%s", state["repo_name"], state["pr_number"]
+        )
+        speculative_patch.cancel()
+        speculative_patch = None
+        speculative_issues = None
+    return {
+        "pr_diff": pr_diff,
+        "review_result": review_result,
+        "speculative_patch": speculative_patch,
+        "speculative_issues": speculative_issues,
+    }
 
 
 async def patcher_agent(state: GraphState) -> GraphState:
     logger.info("Patcher agent started for %s#%s", state["repo_name"], state["pr_number"])
     review_result = state.get("review_result")
-    if not review_result or not review_result.has_bugs:
-        logger.info("Patcher agent skipped for %s#%s", state["repo_name"], state["pr_number"])
-        return {"patch_code": None}
+    # Clean reviews are routed to the lgtm node; the reviewer cancels their speculative patch.
+    if review_result is None or not review_result.has_bugs:
+        raise RuntimeError("Patcher agent reached without a review that found bugs")
+    speculative_patch = state.get("speculative_patch")
 
-    llm = _build_chat_model()
-    prompt = ChatPromptTemplate.from_messages(
-        [
-            (
-                "system",
-                (
-                    "You are a principal engineer. Based on review issues, generate concrete patch guidance "
-                    "or code snippets to fix the bugs. Keep output concise and markdown-friendly."
-                ),
-            ),
-            (
-                "human",
-                (
-                    "PR diff:\n{pr_diff}\n\n"
-                    "Review result:\n{review_result}\n\n"
-                    "Return a patch proposal with code snippets."
-                ),
-            ),
-        ]
-    )
-    chain = prompt | llm
-    patch_resp = await chain.ainvoke(
-        {
-            "pr_diff": state["pr_diff"],
-            "review_result": review_result.model_dump_json(indent=2),
-        }
-    )
-    patch_code = patch_resp.content if isinstance(patch_resp.content, str) else str(patch_resp.content)
+    patch_code: str | None = None
+    if speculative_patch is not None and state.get("speculative_issues") != review_result.issues:
+        logger.info(
+            "Discarding speculative patch for %s#%s, review changed after it started",
+            state["repo_name"],
+            state["pr_number"],
+        )
+        speculative_patch.cancel()
+    elif speculative_patch is not None:
+        try:
+            patch_code = await asyncio.shield(speculative_patch)
+            logger.info(
+                "Using speculative patch for %s#%s", state["repo_name"], state["pr_number"]
+            )
+        except asyncio.CancelledError:
+            speculative_patch.cancel()
+            raise
+        except Exception:
+            logger.exception(
+                "Speculative patch failed for %s#%s, regenerating",
+                state["repo_name"],
+                state["pr_number"],
+            )
+
+    review_result_json = state.get("review_result_json") or _dump_review(review_result)
+    if patch_code is None:
+        patch_code = await _generate_patch(state["pr_diff"], review_result_json)
     logger.info("Patcher agent finished for %s#%s", state["repo_name"], state["pr_number"])
-    return {"patch_code": patch_code}
+    return {
+        "patch_code": patch_code,
+        "review_result_json": review_result_json,
+        "speculative_patch": None,
+        "speculative_issues": None,
+    }
+
+
+async def _post_comment(state: GraphState, final_comment: str) -> None:
+    comment_queue = state.get("comment_queue")
+    if comment_queue is not None:
+        await comment_queue.enqueue(state["repo_name"], state["pr_number"], final_comment)
+        return
+
+    github_client = state.get("github_client")
+    if github_client is not None:
+        await github_client.post_pr_comment(
+            repo_full_name=state["repo_name"],
+            pr_number=state["pr_number"],
+            body=final_comment,
+        )
+        return
+
+    async with GitHubClient() as github_client:
+        await github_client.post_pr_comment(
+            repo_full_name=state["repo_name"],
+            pr_number=state["pr_number"],
+            body=final_comment,
+        )
+
+
+async def lgtm_agent(state: GraphState) -> GraphState:
+    logger.info("LGTM agent started for %s#%s", state["repo_name"], state["pr_number"])
+    review_result = state.get("review_result")
+    summary = review_result.summary if review_result else "No review summary available."
+    final_comment = (
+        "## PR Review Result\n\n"
+        "LGTM ✅\n\n"
+        f"{summary}\n\n"
+        "No blocking issues found."
+    )
+    await _post_comment(state, final_comment)
+    logger.info("LGTM agent finished for %s#%s", state["repo_name"], state["pr_number"])
+    return {"final_comment": final_comment}
 
 
 async def committer_agent(state: GraphState) -> GraphState:
     logger.info("Committer agent started for %s#%s", state["repo_name"], state["pr_number"])
     review_result = state.get("review_result")
     patch_code = state.get("patch_code")
-    llm = _build_chat_model()
-
-    if review_result and not review_result.has_bugs:
-        final_comment = (
-            "## PR Review Result\n\n"
-            "LGTM ✅\n\n"
-            f"{review_result.summary}\n\n"
-            "No blocking issues found."
-        )
-    else:
-        prompt = ChatPromptTemplate.from_messages(
-            [
-                (
-                    "system",
-                    (
-                        "You are a friendly code review assistant. Generate a GitHub PR comment in markdown, "
-                        "including a short summary, issue list, and suggested fix snippets."
-                    ),
-                ),
-                (
-                    "human",
-                    (
-                        "Review result JSON:\n{review_result}\n\n"
-                        "Patch proposal:\n{patch_code}\n\n"
-                        "Produce final PR review comment."
-                    ),
-                ),
-            ]
-        )
-        chain = prompt | llm
-        comment_resp = await chain.ainvoke(
-            {
-                "review_result": review_result.model_dump_json(indent=2) if review_result else "{}",
-                "patch_code": patch_code or "N/A",
-            }
-        )
-        final_comment = (
-            comment_resp.content
-            if isinstance(comment_resp.content, str)
-            else str(comment_resp.content)
-        )
+    review_result_json = state.get("review_result_json")
+    if review_result_json is None:
+        review_result_json = _dump_review(review_result) if review_result else "{}"
 
-    github_client = state.get("github_client") or GitHubClient()
-    await github_client.post_pr_comment(
-        repo_full_name=state["repo_name"],
-        pr_number=state["pr_number"],
-        body=final_comment,
+    chain = _COMMENT_PROMPT | _build_chat_model(_model_name())
+    await _llm_limiter().acquire()
+    comment_resp = await chain.ainvoke(
+        {
+            "review_result": review_result_json,
+            "patch_code": patch_code or "N/A",
+        }
     )
+    final_comment = (
+        comment_resp.content
+        if isinstance(comment_resp.content, str)
+        else str(comment_resp.content)
+    )
+
+    await _post_comment(state, final_comment)
     logger.info("Committer agent finished for %s#%s", state["repo_name"], state["pr_number"])
     return {"final_comment": final_comment}
@@ -25,4 +25,8 @@ class GraphState(TypedDict):
     review_result: ReviewResult | None
     patch_code: str | None
     final_comment: str | None
+    review_result_json: NotRequired[str]
     github_client: NotRequired[Any]
+    comment_queue: NotRequired[Any]
+    speculative_patch: NotRequired[Any]
+    speculative_issues: NotRequired[list[ReviewIssue] | None]
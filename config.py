@@ -11,11 +11,22 @@ class Settings(BaseSettings):
 
     llm_provider: str = Field("gemini", alias="LLM_PROVIDER")
     llm_model: str = Field("gemini-1.5-flash", alias="LLM_MODEL")
+    llm_fast_model: str | None = Field(None, alias="LLM_FAST_MODEL")
+    llm_fast_diff_max_chars: int = Field(4096, alias="LLM_FAST_DIFF_MAX_CHARS")
+    llm_max_diff_tokens: int = Field(12000, alias="LLM_MAX_DIFF_TOKENS")
     github_api_base_url: str = Field("https://api.github.com", alias="GITHUB_API_BASE_URL")
     github_request_timeout_seconds: float = Field(30.0, alias="GITHUB_REQUEST_TIMEOUT_SECONDS")
     github_max_retries: int = Field(3, alias="GITHUB_MAX_RETRIES")
     github_retry_backoff_seconds: float = Field(1.0, alias="GITHUB_RETRY_BACKOFF_SECONDS")
     github_retry_max_backoff_seconds: float = Field(8.0, alias="GITHUB_RETRY_MAX_BACKOFF_SECONDS")
+    github_max_connections: int = Field(100, alias="GITHUB_MAX_CONNECTIONS")
+    github_max_keepalive_connections: int = Field(20, alias="GITHUB_MAX_KEEPALIVE_CONNECTIONS")
+    github_max_diff_bytes: int = Field(256 * 1024, alias="GITHUB_MAX_DIFF_BYTES")
+    review_shutdown_timeout_seconds: float = Field(120.0, alias="REVIEW_SHUTDOWN_TIMEOUT_SECONDS")
+    comment_queue_max_size: int = Field(100, alias="COMMENT_QUEUE_MAX_SIZE")
+    comment_shutdown_timeout_seconds: float = Field(30.0, alias="COMMENT_SHUTDOWN_TIMEOUT_SECONDS")
+    max_concurrent_prs: int = Field(4, alias="MAX_CONCURRENT_PRS")
+    llm_max_requests_per_minute: float = Field(60.0, alias="LLM_MAX_REQUESTS_PER_MINUTE")
     log_level: str = Field("INFO", alias="LOG_LEVEL")
 
     model_config = SettingsConfigDict(
@@ -1,15 +1,19 @@
 import hashlib
 import hmac
 import logging
+import random
 from typing import Any
 
 import httpx
-from asyncio import sleep
+from asyncio import CancelledError, Queue, Task, create_task, sleep, wait_for
 
 from config import get_settings
 
 logger = logging.getLogger(__name__)
 
+# "sha256=" followed by the 64 hex characters of a SHA-256 digest.
+_SIGNATURE_LENGTH = len("sha256=") + 2 * hashlib.sha256().digest_size
+
 
 class GitHubClient:
     def __init__(self) -> None:
@@ -19,28 +23,65 @@ class GitHubClient:
         self.max_retries = self.settings.github_max_retries
         self.retry_backoff_seconds = self.settings.github_retry_backoff_seconds
         self.retry_max_backoff_seconds = self.settings.github_retry_max_backoff_seconds
+        self.max_diff_bytes = self.settings.github_max_diff_bytes
         self._headers = {
             "Authorization": f"Bearer {self.settings.github_token}",
             "Accept": "application/vnd.github+json",
             "X-GitHub-Api-Version": "2022-11-28",
             "User-Agent": "Agentic-PR-Reviewer",
         }
+        # The shared client already sends self._headers; only the Accept override is needed.
+        self._diff_headers = {"Accept": "application/vnd.github.v3.diff"}
+        self._hmac_template = hmac.new(
+            key=self.settings.github_webhook_secret.encode("utf-8"),
+            digestmod=hashlib.sha256,
+        )
+        self._client = httpx.AsyncClient(
+            base_url=self.base_url,
+            headers=self._headers,
+            timeout=self.timeout,
+            http2=True,
+            limits=httpx.Limits(
+                max_connections=self.settings.github_max_connections,
+                max_keepalive_connections=self.settings.github_max_keepalive_connections,
+            ),
+        )
+
+    async def aclose(self) -> None:
+        await self._client.aclose()
+
+    async def __aenter__(self) -> "GitHubClient":
+        return self
+
+    async def __aexit__(self, *exc_info: object) -> None:
+        await self.aclose()
 
     def verify_webhook_signature(self, payload: bytes, signature: str) -> bool:
         if not signature or not signature.startswith("sha256="):
             return False
+        if len(signature) != _SIGNATURE_LENGTH:
+            return False
 
-        digest = hmac.new(
-            key=self.settings.github_webhook_secret.encode("utf-8"),
-            msg=payload,
-            digestmod=hashlib.sha256,
-        ).hexdigest()
-        expected_signature = f"sha256={digest}"
-        return hmac.compare_digest(expected_signature, signature)
+        _, _, hex_signature = signature.partition("=")
+        try:
+            signature_bytes = bytes.fromhex(hex_signature)
+        except ValueError:
+            return False
+
+        mac = self._hmac_template.copy()
+        mac.update(payload)
+        return hmac.compare_digest(mac.digest(), signature_bytes)
 
     def _is_retryable_status(self, status_code: int) -> bool:
         return status_code == 429 or 500 <= status_code <= 599
 
+    def _backoff_delay(self, attempt: int) -> float:
+        # Full jitter keeps concurrent retries from hitting GitHub in lockstep.
+        return random.uniform(
+            0,
+            min(self.retry_backoff_seconds * (2**attempt), self.retry_max_backoff_seconds),
+        )
+
     async def _request_with_retry(
         self,
         method: str,
@@ -48,31 +89,33 @@ class GitHubClient:
         *,
         headers: dict[str, str] | None = None,
         json: dict[str, Any] | None = None,
+        stream: bool = False,
     ) -> httpx.Response:
         last_error: Exception | None = None
 
         for attempt in range(self.max_retries + 1):
             try:
-                async with httpx.AsyncClient(timeout=self.timeout) as client:
-                    response = await client.request(
-                        method=method,
-                        url=url,
-                        headers=headers,
-                        json=json,
-                    )
+                request = self._client.build_request(
+                    method=method,
+                    url=url,
+                    headers=headers,
+                    json=json,
+                )
+                response = await self._client.send(request, stream=stream)
 
                 if not self._is_retryable_status(response.status_code):
+                    if response.is_error:
+                        await response.aclose()
                     response.raise_for_status()
                     return response
 
+                await response.aclose()
+
                 retry_after = response.headers.get("Retry-After")
                 if retry_after and retry_after.isdigit():
                     delay = float(retry_after)
                 else:
-                    delay = min(
-                        self.retry_backoff_seconds * (2**attempt),
-                        self.retry_max_backoff_seconds,
-                    )
+                    delay = self._backoff_delay(attempt)
 
                 logger.warning(
                     "GitHub API retryable status=%s attempt=%s/%s url=%s delay=%ss",
@@ -87,10 +130,7 @@ class GitHubClient:
                 await sleep(delay)
             except (httpx.TimeoutException, httpx.NetworkError) as exc:
                 last_error = exc
-                delay = min(
-                    self.retry_backoff_seconds * (2**attempt),
-                    self.retry_max_backoff_seconds,
-                )
+                delay = self._backoff_delay(attempt)
                 logger.warning(
                     "GitHub API network error attempt=%s/%s url=%s delay=%ss error=%s",
                     attempt + 1,
@@ -108,33 +148,94 @@ class GitHubClient:
         raise RuntimeError("Unexpected retry flow in GitHub client")
 
     async def get_pr_diff(self, repo_full_name: str, pr_number: int) -> str:
-        url = f"{self.base_url}/repos/{repo_full_name}/pulls/{pr_number}"
-        headers = {**self._headers, "Accept": "application/vnd.github.v3.diff"}
+        url = f"/repos/{repo_full_name}/pulls/{pr_number}"
 
         logger.info("Fetching PR diff for %s#%s", repo_full_name, pr_number)
-        response = await self._request_with_retry("GET", url, headers=headers)
+        response = await self._request_with_retry(
+            "GET", url, headers=self._diff_headers, stream=True
+        )
+        buffer = bytearray()
+        truncated = False
+        try:
+            async for chunk in response.aiter_bytes():
+                buffer += chunk
+                if len(buffer) > self.max_diff_bytes:
+                    truncated = True
+                    break
+        finally:
+            await response.aclose()
+
+        if truncated:
+            del buffer[self.max_diff_bytes :]
+            logger.warning(
+                "Truncated PR diff for %s#%s at %s bytes",
+                repo_full_name,
+                pr_number,
+                self.max_diff_bytes,
+            )
         logger.info(
             "Fetched PR diff for %s#%s with status %s",
             repo_full_name,
             pr_number,
             response.status_code,
         )
-        return response.text
+        return buffer.decode("utf-8", "replace")
 
     async def post_pr_comment(self, repo_full_name: str, pr_number: int, body: str) -> None:
-        url = f"{self.base_url}/repos/{repo_full_name}/issues/{pr_number}/comments"
+        url = f"/repos/{repo_full_name}/issues/{pr_number}/comments"
         payload = {"body": body}
 
         logger.info("Posting PR comment to %s#%s", repo_full_name, pr_number)
-        response = await self._request_with_retry(
-            "POST",
-            url,
-            headers=self._headers,
-            json=payload,
-        )
+        response = await self._request_with_retry("POST", url, json=payload)
         logger.info(
             "Posted PR comment to %s#%s with status %s",
             repo_full_name,
             pr_number,
             response.status_code,
         )
+
+
+class GitHubCommentQueue:
+    def __init__(self, github_client: GitHubClient, max_size: int = 100) -> None:
+        self._github_client = github_client
+        self._queue: Queue[tuple[str, int, str]] = Queue(maxsize=max_size)
+        self._worker: Task | None = None
+
+    def start(self) -> None:
+        if self._worker is None:
+            self._worker = create_task(self._run())
+
+    async def stop(self, timeout: float | None = None) -> None:
+        if self._worker is None:
+            return
+        try:
+            await wait_for(self._queue.join(), timeout)
+        except TimeoutError:
+            logger.warning(
+                "Timed out after %ss draining PR comments, dropped %s queued comments",
+                timeout,
+                self._queue.qsize(),
+            )
+        self._worker.cancel()
+        try:
+            await self._worker
+        except CancelledError:
+            pass
+        self._worker = None
+
+    async def enqueue(self, repo_full_name: str, pr_number: int, body: str) -> None:
+        # Blocks when the queue is full, applying backpressure to the review graph.
+        await self._queue.put((repo_full_name, pr_number, body))
+        logger.info("Queued PR comment for %s#%s", repo_full_name, pr_number)
+
+    async def _run(self) -> None:
+        while True:
+            repo_full_name, pr_number, body = await self._queue.get()
+            try:
+                await self._github_client.post_pr_comment(repo_full_name, pr_number, body)
+            except Exception:
+                logger.exception(
+                    "Failed to post queued PR comment to %s#%s", repo_full_name, pr_number
+                )
+            finally:
+                self._queue.task_done()
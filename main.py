@@ -1,35 +1,62 @@
 import logging
+import logging.handlers
+import queue
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
 
-from fastapi import BackgroundTasks, FastAPI, Header, HTTPException, Request
+import orjson
+from fastapi import FastAPI, Header, HTTPException, Request
 
-from agent.graph import run_pr_review
+from agent.graph import PRReviewQueue, get_graph
 from config import get_settings
-from github_api.client import GitHubClient
+from github_api.client import GitHubClient, GitHubCommentQueue
 
 settings = get_settings()
+
+# Records are enqueued on the event loop and formatted/written by a listener thread.
+_log_queue: queue.SimpleQueue[logging.LogRecord] = queue.SimpleQueue()
+_log_stream_handler = logging.StreamHandler()
+_log_stream_handler.setFormatter(
+    logging.Formatter("%(asctime)s | %(levelname)s | %(name)s | %(message)s")
+)
+_log_listener = logging.handlers.QueueListener(_log_queue, _log_stream_handler)
+_log_queue_handler = logging.handlers.QueueHandler(_log_queue)
+# QueueHandler.prepare() stores the formatted text in record.msg; with a bare "%(message)s"
+# it only merges the args, leaving the full format to the listener's handler.
+_log_queue_handler.setFormatter(logging.Formatter("%(message)s"))
 logging.basicConfig(
     level=getattr(logging, settings.log_level.upper(), logging.INFO),
-    format="%(asctime)s | %(levelname)s | %(name)s | %(message)s",
+    handlers=[_log_queue_handler],
 )
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="Agentic PR Reviewer", version="0.1.0")
-
 
-async def process_pr(repo_name: str, pr_number: int) -> None:
-    client = GitHubClient()
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    _log_listener.start()
+    get_graph()
+    app.state.github_client = GitHubClient()
+    app.state.comment_queue = GitHubCommentQueue(
+        app.state.github_client,
+        max_size=settings.comment_queue_max_size,
+    )
+    app.state.comment_queue.start()
+    app.state.review_queue = PRReviewQueue(
+        app.state.github_client,
+        max_concurrent_prs=settings.max_concurrent_prs,
+        comment_queue=app.state.comment_queue,
+    )
+    app.state.review_queue.start()
     try:
-        logger.info("Background task started for %s#%s", repo_name, pr_number)
-        pr_diff = await client.get_pr_diff(repo_name, pr_number)
-        await run_pr_review(
-            repo_name=repo_name,
-            pr_number=pr_number,
-            pr_diff=pr_diff,
-            github_client=client,
-        )
-        logger.info("Background task completed for %s#%s", repo_name, pr_number)
-    except Exception:
-        logger.exception("Background task failed for %s#%s", repo_name, pr_number)
+        yield
+    finally:
+        await app.state.review_queue.stop(timeout=settings.review_shutdown_timeout_seconds)
+        await app.state.comment_queue.stop(timeout=settings.comment_shutdown_timeout_seconds)
+        await app.state.github_client.aclose()
+        _log_listener.stop()
+
+
+app = FastAPI(title="Agentic PR Reviewer", version="0.1.0", lifespan=lifespan)
 
 
 @app.get("/healthz")
@@ -40,12 +67,11 @@ async def healthz() -> dict[str, str]:
 @app.post("/webhook")
 async def github_webhook(
     request: Request,
-    background_tasks: BackgroundTasks,
     x_hub_signature_256: str | None = Header(default=None),
     x_github_event: str | None = Header(default=None),
 ) -> dict[str, str]:
     payload = await request.body()
-    client = GitHubClient()
+    client: GitHubClient = request.app.state.github_client
 
     if not client.verify_webhook_signature(payload, x_hub_signature_256 or ""):
         logger.warning("Webhook signature verification failed")
@@ -55,7 +81,10 @@ async def github_webhook(
         logger.info("Ignored webhook event: %s", x_github_event)
         return {"status": "Ignored event"}
 
-    data = await request.json()
+    try:
+        data = orjson.loads(payload)
+    except orjson.JSONDecodeError as exc:
+        raise HTTPException(status_code=400, detail="Invalid JSON payload") from exc
     action = data.get("action")
     if action not in {"opened", "synchronize"}:
         logger.info("Ignored pull_request action: %s", action)
@@ -67,5 +96,6 @@ async def github_webhook(
         raise HTTPException(status_code=400, detail="Missing repository or pull request number")
 
     logger.info("Webhook accepted for %s#%s action=%s", repo_name, pr_number, action)
-    background_tasks.add_task(process_pr, repo_name, int(pr_number))
+    review_queue: PRReviewQueue = request.app.state.review_queue
+    await review_queue.submit(repo_name, int(pr_number))
     return {"status": "Processing"}